@@ -98,9 +98,9 @@ class SpecSelector(spv.SpecEvtHandler):
         return self._longest_text
 
     def dispersion(self, calib: Callable[[npt.NDArray], npt.NDArray]):
-        ydata = self._data.data
-        wave_len = calib(np.arange(0, ydata.shape[0]))
-        return (wave_len[ydata.shape[0] - 1] - wave_len[0]) / (ydata.shape[0] - 1)
+        pixels = self._data.data.shape[0]
+        wave_len = calib(np.array([0, pixels - 1]))
+        return (wave_len[1] - wave_len[0]) / (pixels - 1)
 
     def resolution(self, calib: Callable[[npt.NDArray], npt.NDArray]):
         min_width = None
@@ -111,8 +111,9 @@ class SpecSelector(spv.SpecEvtHandler):
         if min_width is None:
             return None
         pixels = self._data.data.shape[0]
-        centre_wave_len = calib(np.arange(pixels / 2, pixels / 2 + 1))[0]
-        return centre_wave_len / (min_width * self.dispersion(calib))
+        first_wave_len, centre_wave_len, last_wave_len = calib(np.array([0, pixels / 2, pixels - 1]))
+        dispersion = (last_wave_len - first_wave_len) / (pixels - 1)
+        return centre_wave_len / (min_width * dispersion)
 
     def _on_click(self, event: MouseEvent):
         prev_selected = None
@@ -148,16 +149,8 @@ class SpecSelector(spv.SpecEvtHandler):
             else:
                 peak_data = self._data.data[x_low:x_hi]
             peaks, props = signal.find_peaks(peak_data, distance=4, prominence=prominence)
-            min_dist = None
-            min_peak = None
-            for peak in peaks:
-                dist = abs(event.xdata - x_low - peak)
-                if min_dist is None or dist < min_dist:
-                    min_dist = dist
-                    min_peak = peak
-                elif min_dist is not None and dist > min_dist:
-                    break
-            if min_peak is not None:
+            if peaks.shape[0] > 0:
+                min_peak = peaks[np.argmin(np.abs(event.xdata - x_low - peaks))]
                 new_entry = SpecEntry(int(x_low + min_peak), None)
                 entry_row = 0
                 if len(self._entries) == 0:
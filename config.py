@@ -1,13 +1,17 @@
 import astropy.units as u
+import numpy as np
+import numpy.ma as ma
+import numpy.typing as npt
 import wx
 
 from astropy.coordinates import EarthLocation, Latitude, Longitude
 from astropy.table import Table
 from dataclasses import dataclass
+from functools import lru_cache
 from os import PathLike
 from pathlib import Path
 from threading import Lock
-from typing import List, Union, Sequence, Tuple
+from typing import Any, List, Union, Sequence, Tuple
 
 
 MIN_WAVELEN = 3000
@@ -392,17 +396,41 @@ class Config:
 
     @staticmethod
     def get_calib_table(name: str) -> Union[None, Table]:
-        file = Config._get_calib_dir() / (name.replace(' ', '_') + '.fits')
+        return Config._read_calib_table(name.replace(' ', '_'))
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _read_calib_table(stem: str) -> Union[None, Table]:
+        file = Config._get_calib_dir() / (stem + '.fits')
         if file.exists():
             return Table.read(file)
         return None
 
+    @staticmethod
+    def get_calib_lines(name: str) -> Union[None, Tuple[npt.NDArray[Any], npt.NDArray[Any]]]:
+        return Config._parse_calib_lines(name.replace(' ', '_'))
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _parse_calib_lines(stem: str) -> Union[None, Tuple[npt.NDArray[Any], npt.NDArray[Any]]]:
+        table = Config._read_calib_table(stem)
+        if not table:
+            return None
+        wavelengths = np.asarray(ma.filled(table['Observed'], np.nan), dtype=np.float64)
+        rel_ints = np.asarray(ma.filled(table['Rel.'].astype(str), ''))
+        intensities = np.fromiter((_parse_rel_int(r) for r in rel_ints), dtype=np.float64, count=len(rel_ints))
+        valid = np.flatnonzero(~np.isnan(wavelengths) & ~np.isnan(intensities))
+        valid = valid[np.argsort(wavelengths[valid], kind='stable')]
+        return wavelengths[valid], intensities[valid]
+
     @staticmethod
     def save_calib_table(name: str, table: Table):
         ini_dir = Config._get_calib_dir()
         ini_dir.mkdir(parents=True, exist_ok=True)
         file = ini_dir / (name.replace(' ', '_') + '.fits')
         table.write(file)
+        Config._read_calib_table.cache_clear()
+        Config._parse_calib_lines.cache_clear()
 
     @staticmethod
     def _get_calib_dir():
@@ -411,3 +439,10 @@ class Config:
         if user_config_path.exists() and not user_config_path.is_dir():
             user_config_path = Path(user_config_dir + '_data')
         return user_config_path / 'calib'
+
+
+def _parse_rel_int(rel_int: str) -> float:
+    n_digits = len(rel_int) - len(rel_int.lstrip('0123456789'))
+    if n_digits == 0:
+        return np.nan
+    return float(rel_int[:n_digits])
@@ -1,11 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from math import sqrt, log
+from math import ceil, sqrt, log
+from os.path import commonprefix
 from pathlib import Path
 from typing import Union, Tuple, Sequence, Any, Callable, Dict
 
 import matplotlib.pyplot as plt
 import numpy as np
-import numpy.ma as ma
 import numpy.polynomial as npp
 import numpy.typing as npt
 import scipy.ndimage as scn
@@ -27,6 +28,12 @@ class ImageBounds:
     sky_high: int
 
 
+@dataclass
+class _OptimalWorkspace:
+    variance: npt.NDArray[Any]
+    sky: npt.NDArray[Any]
+
+
 def simple(input_files: Union[Path, Sequence[Path]],
            limits: Union[Tuple[int, int], Sequence[int]],
            output_path: Path):
@@ -34,31 +41,27 @@ def simple(input_files: Union[Path, Sequence[Path]],
     if isinstance(input_files, Path):
         input_files = [input_files]
     out_name = _get_common_name(input_files, 'simple-1d')
-    out_data = None
-    for i in range(len(input_files)):
-        spectrum, header = simple_single(input_files[i], limits)
+    spectrum = np.empty(fits.getval(input_files[0], 'NAXIS1'), dtype=np.float32)
+    out_spectrum = np.zeros(spectrum.shape)
+    for input_file in input_files:
+        _, header = simple_single(input_file, limits, out=spectrum)
         headers.append(header)
-        if out_data is None:
-            out_data = np.empty((len(input_files), spectrum.shape[0]), dtype=np.float32)
-        out_data[i] = spectrum[:]
-    out_spectrum = np.mean(out_data, axis=0)
-    out_hdu = fits.PrimaryHDU(out_spectrum, headers[0])
-    output_file = output_path / out_name
-    out_hdu.writeto(output_file, overwrite=True)
+        out_spectrum += spectrum
+    out_spectrum /= len(input_files)
+    _write_spectrum(out_spectrum.astype(np.float32), headers[0], output_path / out_name)
 
 
-def simple_single(input_file: Path, limits: Union[Tuple[int, int], Sequence[int]]) -> Tuple[
-    npt.NDArray[Any], fits.Header]:
+def simple_single(input_file: Path, limits: Union[Tuple[int, int], Sequence[int]],
+                  out: Union[None, npt.NDArray[Any]] = None) -> Tuple[npt.NDArray[Any], fits.Header]:
     if len(limits) != 2:
         raise ValueError('limits have wrong length')
     lower, upper = sorted(limits)
-    in_hdu_l = fits.open(input_file)
-    data: npt.NDArray[Any] = in_hdu_l[0].data
-    if lower < 0 or upper > data.shape[0]:
-        raise ValueError('limits are out of bounds')
-    spectrum = np.sum(data[lower:upper, :], axis=0, dtype=np.float32)
-    header = in_hdu_l[0].header
-    in_hdu_l.close()
+    # Only the rows between the limits are read from the file
+    with fits.open(input_file) as in_hdu_l:
+        header = in_hdu_l[0].header
+        if lower < 0 or upper > header['NAXIS2']:
+            raise ValueError('limits are out of bounds')
+        spectrum = np.sum(in_hdu_l[0].section[lower:upper, :], axis=0, dtype=np.float32, out=out)
     return spectrum, header
 
 
@@ -70,60 +73,50 @@ def optimal(input_files: Union[Path, Sequence[Path]],
     if isinstance(input_files, Path):
         input_files = [input_files]
     cam_cfg = Config.get().get_camera_config(config_name)
-    headers = []
-    out_data = None
-    d_low = None
-    d_high = None
     progress = start_with
     prog_step = int(budget / len(input_files))
-    spectra = []
+    results = []
+    # The frames of a batch usually share their size, so the image buffers
+    # are kept around for the next frame
+    workspace = None
     for i in range(len(input_files)):
         if callback is not None:
             msg = f'Extracting spectrum from {input_files[i].name}.'
             if callback(progress, msg):
                 return None, None
-        in_hdu_l = fits.open(input_files[i])
-        data = in_hdu_l[0].data
-        headers.append(in_hdu_l[0].header)
-        if out_data is None:
-            out_data = np.empty((len(input_files), data.shape[1]))
-            d_low = data.shape[0]
-            d_high = 0
-        spectrum, n_d_low, n_d_high = _optimal(data, cam_cfg)
-        in_hdu_l.close()
-        if spectrum is not None:
-            spectra.append(spectrum)
-        out_data[i] = spectrum[:]
-        if n_d_low < d_low:
-            d_low = n_d_low
-        if n_d_high > d_high:
-            d_high = n_d_high
+        header, data = _read_frame(input_files[i])
+        if workspace is None or workspace.variance.shape != data.shape:
+            workspace = _OptimalWorkspace(np.empty(data.shape, dtype=np.float32),
+                                          np.empty(data.shape, dtype=np.float32))
+        spectrum, d_low, d_high = _optimal(data, cam_cfg, workspace)
+        results.append((header, spectrum, d_low, d_high))
         progress += prog_step
 
-    if len(spectra) == 0:
+    out_name = _get_common_name(input_files, 'optimal-1d')
+    input_files = [input_files[i] for i in range(len(results)) if results[i][1] is not None]
+    results = [result for result in results if result[1] is not None]
+    if len(results) == 0:
         return None, None
 
-    out_data = np.array(spectra)
-    out_name = _get_common_name(input_files, 'optimal-1d')
+    headers = [result[0] for result in results]
+    d_low = min(result[2] for result in results)
+    d_high = max(result[3] for result in results)
     if out_name != 'optimal-1d':
-        out_spectrum = np.mean(out_data, axis=0)
-        min_time = None
-        max_time = None
-        end_time = None
-        total_exptime = 0.0
-        for header in headers:
-            head_time = Time(header['DATE-OBS'], format='isot', scale='utc')
-            total_exptime += float(header['EXPTIME'])
-            if min_time is None or head_time < min_time:
-                min_time = head_time
-            if max_time is None or head_time > max_time:
-                max_time = head_time
-                end_time = max_time + TimeDelta(header['EXPTIME'], format='sec')
+        out_spectrum = np.zeros(results[0][1].shape)
+        for result in results:
+            out_spectrum += result[1]
+        out_spectrum /= len(results)
+        start_times = Time([header['DATE-OBS'] for header in headers], format='isot', scale='utc')
+        exptimes = TimeDelta([float(header['EXPTIME']) for header in headers], format='sec')
+        min_time = start_times.min()
+        i_max = start_times.argmax()
+        end_time = start_times[i_max] + exptimes[i_max]
+        total_exptime = float(np.sum(exptimes.sec))
         header = fits.Header()
         header.add_comment("FITS (Flexible Image Transport System) is defined in 'Astronomy")
         header.add_comment("and Astrophysics', volume 376, page 359; bibcode: 2001A&A...376..359H")
-        if out_data.shape[0] > 1:
-            header.add_comment(f'Spectrum is average of {out_data.shape[0]} spectra.')
+        if len(results) > 1:
+            header.add_comment(f'Spectrum is average of {len(results)} spectra.')
             header.add_comment('Spectra extracted by optimal method.')
         else:
             header.add_comment('Spectrum extracted by optimal method.')
@@ -139,39 +132,57 @@ def optimal(input_files: Union[Path, Sequence[Path]],
             for key in header_overrides.keys():
                 header[key] = header_overrides[key]
 
-        out_hdu = fits.PrimaryHDU(out_spectrum, header)
-        output_file = output_path / out_name
-        out_hdu.writeto(output_file, overwrite=True)
+        _write_spectrum(out_spectrum, header, output_path / out_name)
     else:
-        for i in range(0, len(input_files)):
-            out_name = input_files[i].name
-            fits.PrimaryHDU(out_data[i, :], headers[i]).writeto(output_path / out_name, overwrite=True)
+        # Writing is I/O bound, so the threads don't contend for the GIL much
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_write_spectrum, results[i][1], headers[i], output_path / input_files[i].name)
+                       for i in range(0, len(input_files))]
+            for future in futures:
+                future.result()
     return d_low, d_high
 
 
+def _read_frame(input_file: Path) -> Tuple[fits.Header, npt.NDArray[Any]]:
+    with fits.open(input_file) as in_hdu_l:
+        header = in_hdu_l[0].header
+        data = np.asarray(in_hdu_l[0].data, dtype=np.float32)
+    return header, data
+
+
+def _write_spectrum(spectrum: npt.NDArray[Any], header: fits.Header, output_file: Path):
+    # The headers are either copied from the input or created here, so
+    # verifying them again is a waste of time
+    fits.PrimaryHDU(spectrum, header).writeto(output_file, overwrite=True, output_verify='ignore')
+
+
 def _get_common_name(files: Sequence[Path], default_name: str) -> Union[str, None]:
     if len(files) == 1:
         return files[0].name
 
-    min_len = min(len(files[0].stem), len(files[1].stem))
-    common_idx = 0
-    for common_idx in range(0, min_len + 1):
-        if files[0].stem[common_idx] != files[1].stem[common_idx]:
-            break
-    if common_idx == 0:
+    out_name = commonprefix([f.stem for f in files])
+    if not out_name:
         out_name = default_name
-    else:
-        out_name = files[0].stem[0:common_idx]
     return out_name + files[0].suffix
 
 
-def _optimal(data: npt.NDArray[Any], config: CameraConfig) -> Union[
+def _optimal(data: npt.NDArray[Any], config: CameraConfig,
+             workspace: Union[None, _OptimalWorkspace] = None) -> Union[
         Tuple[npt.NDArray[Any], int, int], Tuple[None, None, None]]:
     image_bounds = _find_image_bounds(data)
     if image_bounds is None:
         return None, None, None
-    variance = (np.abs(data) + config.ron ** 2 / config.gain) / config.gain
-    sky = _create_sky_image(data, variance, image_bounds)
+    if workspace is None:
+        workspace = _OptimalWorkspace(np.empty(data.shape, dtype=np.float32),
+                                      np.empty(data.shape, dtype=np.float32))
+    # Computed in place and in single precision, i.e. without allocation and
+    # with half the memory traffic of the double precision expression
+    data = data.astype(np.float32, copy=False)
+    variance = workspace.variance
+    np.abs(data, out=variance)
+    variance /= np.float32(config.gain)
+    variance += np.float32((config.ron / config.gain) ** 2)
+    sky = _create_sky_image(data, variance, image_bounds, out=workspace.sky)
     if sky is None:
         return None, None, None
     spectrum = _extract_spectrum(data, sky, variance, image_bounds, config)
@@ -191,15 +202,7 @@ def _find_image_bounds(data: npt.NDArray[Any], plot: bool = False) -> Union[None
         if len(peaks) == 0:
             wx.LogMessage('No signal found.')
             return None
-    if len(peaks) > 1:
-        peak = None
-        max_peak = None
-        for c_peak in peaks:
-            if max_peak is None or x_avg[c_peak] > max_peak:
-                peak = c_peak
-                max_peak = x_avg[c_peak]
-    else:
-        peak = peaks[0]
+    peak = peaks[np.argmax(x_avg[peaks])]
 
     # Attempt to fit gaussian to first approximation peak
     # y = a + b * exp(-0.5 * [(x - c) / d]**2)
@@ -235,47 +238,45 @@ def _find_image_bounds(data: npt.NDArray[Any], plot: bool = False) -> Union[None
 
 
 def _create_sky_image(data: npt.NDArray[Any], variance: npt.NDArray[Any],
-                      bounds: Union[None, ImageBounds], plot: bool = False) -> Union[None, npt.NDArray[Any]]:
+                      bounds: Union[None, ImageBounds], plot: bool = False,
+                      out: Union[None, npt.NDArray[Any]] = None) -> Union[None, npt.NDArray[Any]]:
     if bounds is None:
         return None
-    masked_data = data.view(ma.MaskedArray)
-    masked_variance = variance.view(ma.MaskedArray)
-    weights = 1.0 / masked_variance
+    sky = np.ones(data.shape[0], dtype=bool)
     if bounds.sky_high < bounds.data_low:
         # spectrum trace is on the upper edge of the image
-        masked_data[bounds.sky_high:, :] = ma.masked
+        sky[bounds.sky_high:] = False
     elif bounds.data_high < bounds.sky_low:
         # spectrum trace is on the lower edge of the image
-        masked_data[0:bounds.sky_low, :] = ma.masked
+        sky[0:bounds.sky_low] = False
     else:
         # well-behaved image
-        masked_data[bounds.sky_low:bounds.sky_high] = ma.masked
-    weights.mask = masked_data.mask
-
-    result = np.empty(data.shape)
-    for x in range(0, data.shape[1]):
-        x_data = ma.arange(0, data.shape[0])
-        x_data.mask = masked_data.mask[:, x]
-        y_data = masked_data[:, x]
-        y_data.mask = x_data.mask
-        y_weights = weights[:, x]
-        y_weights.mask = y_data.mask
-
-        rejected = True
-        while rejected:
-            poly = npp.Polynomial.fit(x_data, y_data, deg=2, w=y_weights)
-            residual = (y_data - poly(x_data)) ** 2 * y_weights
-            rej_idx = ma.nonzero(residual > 16)
-            rejected = False
-            if len(rej_idx[0]):
-                rejected = True
-                for idx in rej_idx[0]:
-                    x_data[idx] = ma.masked
-                y_data.mask = x_data.mask
-                y_weights.mask = y_data.mask
-
-        x_data.mask = ma.nomask
-        result[:, x] = poly(x_data)
+        sky[max(bounds.sky_low, 0):bounds.sky_high] = False
+    # Only the sky rows take part in the fit, so pick them once
+    sky_rows = np.nonzero(sky)[0]
+    if len(sky_rows) < 3:
+        wx.LogMessage('Not enough sky background.')
+        return None
+    sky_data = data[sky_rows]
+    weights = 1.0 / variance[sky_rows]
+    rejected_px = np.zeros(sky_data.shape, dtype=bool)
+
+    # Fit a quadratic to each column, all columns at once: the normal equations
+    # for the columns are stacked and solved by a single call into LAPACK.
+    y_norm = 2.0 * np.arange(0, data.shape[0]) / (data.shape[0] - 1) - 1.0
+    y_vander = npp.chebyshev.chebvander(y_norm, 2)
+    sky_vander = y_vander[sky_rows]
+    rejected = True
+    while rejected:
+        col_weights = np.where(rejected_px, 0.0, weights)
+        lhs = np.einsum('yi,yx,yj->xij', sky_vander, col_weights, sky_vander)
+        rhs = np.einsum('yi,yx,yx->xi', sky_vander, col_weights, sky_data)
+        coeffs = _solve_stacked(lhs, rhs)
+        residual = (sky_data - sky_vander @ coeffs.T) ** 2 * weights
+        new_rejects = (residual > 16) & ~rejected_px
+        rejected = np.any(new_rejects)
+        rejected_px |= new_rejects
+    result = np.matmul(y_vander, coeffs.T, out=out)
 
     if plot:
         p_img = result
@@ -286,64 +287,76 @@ def _create_sky_image(data: npt.NDArray[Any], variance: npt.NDArray[Any],
     return result
 
 
+def _solve_stacked(lhs: npt.NDArray[Any], rhs: npt.NDArray[Any]) -> npt.NDArray[Any]:
+    try:
+        return np.linalg.solve(lhs, rhs[:, :, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # Some of the systems are singular, e.g. since clipping left too few pixels in
+        # a column or row: use the minimum norm least squares solution for all of them.
+        return np.matmul(np.linalg.pinv(lhs, hermitian=True), rhs[:, :, np.newaxis])[:, :, 0]
+
+
+def _find_nonzero_columns(row: npt.NDArray[Any]) -> Tuple[int, int]:
+    nonzero = np.asarray(row) != 0
+    return int(np.argmax(nonzero)), nonzero.shape[0] - int(np.argmax(nonzero[::-1]))
+
+
 def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_variance: npt.NDArray[Any],
                       bounds: ImageBounds, config: CameraConfig, plot: bool = False) -> npt.NDArray[Any]:
-    masked_data = ma.asarray(data[bounds.data_low:bounds.data_high, :])
-    for xd in range(0, masked_data.shape[1]):
-        if masked_data[0, xd] != 0:
-            break
-        masked_data[:, xd] = ma.masked
-    for xd in range(-1, -masked_data.shape[1], -1):
-        if masked_data[0, xd] != 0:
-            break
-        masked_data[:, xd] = ma.masked
-    masked_sky = ma.asarray(sky[bounds.data_low:bounds.data_high, :])
-    masked_var = ma.asarray(init_variance[bounds.data_low:bounds.data_high, :])
-    net_img = masked_data - masked_sky
-    f_raw = ma.sum(net_img, axis=0)
-    w = f_raw ** 2 / masked_var
+    # Columns with zero values at the borders of the spectrum image are bound to be
+    # artifacts from rotation/slant correction: work on the columns in between only.
+    x_first, x_last = _find_nonzero_columns(data[bounds.data_low])
+    rows = slice(bounds.data_low, bounds.data_high)
+    cols = slice(x_first, x_last)
+    net_img = data[rows, cols] - sky[rows, cols]
+    # Copied, since it's updated in place below
+    var_img = np.array(init_variance[rows, cols], dtype=np.float32)
+    f_raw = np.sum(net_img, axis=0)
+    # Work buffers, reused across all iterations below
+    w = np.empty(net_img.shape, dtype=np.float32)
+    p_r = np.empty(net_img.shape, dtype=np.float32)
+    f_by_p = np.empty(net_img.shape, dtype=np.float32)
+    residual = np.empty(net_img.shape, dtype=np.float32)
+    tmp = np.empty(net_img.shape, dtype=np.float32)
+    np.divide(f_raw ** 2, var_img, out=w)
     # smooth continuum by median filtering
-    p_d = scn.median_filter(net_img / f_raw, size=(1, 8))
-    p_d = ma.asarray(p_d)
-    # Mask any zero values at the borders of the spectrum image:
-    # These are bound to be artifacts from rotation/slant correction
-    for y in range(0, p_d.shape[0]):
-        for xd in range(0, p_d.shape[1]):
-            if p_d[0, xd] != 0:
-                break
-            p_d[:, xd] = ma.masked
-        for xd in range(-1, -masked_data.shape[1], -1):
-            if p_d[0, xd] != 0:
-                break
-            p_d[:, xd] = ma.masked
-
-    p_r = ma.empty(p_d.shape)
-    x = ma.arange(0, masked_data.shape[1])
+    p_d = np.divide(net_img, f_raw, out=np.zeros(net_img.shape, dtype=np.float32), where=f_raw != 0)
+    p_d = scn.median_filter(p_d, size=(1, 8))
+    # pixels rejected from the profile fit
+    p_d_rejected = np.zeros(net_img.shape, dtype=bool)
+
+    x = np.arange(0, net_img.shape[1])
+    # Chebyshev series on [-1, 1] are far better conditioned than a power
+    # series on the pixel scale
+    x_norm = 2.0 * x / (net_img.shape[1] - 1) - 1.0
+    x_vander = npp.chebyshev.chebvander(x_norm, 15)
 
     rejected = True
     while rejected:
-        for y in range(0, masked_data.shape[0]):
-            # tck = interpolate.splrep(x, p_d[y, :], w=w[y, :], k=4, s=p_d.shape[1])
-            # p_r[y, :] = interpolate.splev(x, tck, der=0)
-            # poly = npp.Chebyshev.fit(x, p_d[y, :], deg=5, w=w[y, :])
-            # p_r[y, :] = poly(x)
-            poly = npp.Polynomial.fit(x, p_d[y, :], deg=15, w=w[y, :])
-            p_r[y, :] = poly(x)
-        p_r[p_r < 0] = 0
-        p_r = p_r / ma.sum(p_r, axis=0)
-        f = ma.sum(p_r * net_img / masked_var, axis=0) / ma.sum(p_r ** 2 / masked_var, axis=0)
-        f_by_p = f * p_r
-        masked_var = (ma.abs(f_by_p + masked_sky) + config.ron ** 2 / config.gain) / config.gain
-        residual = (net_img - f_by_p) ** 2 / masked_var
-        residual.mask = p_d.mask
-        rej_idx = np.nonzero(residual > 16)
-        wx.LogMessage(f'stage 1 len rej_idx = {len(rej_idx[0])}')
-        rejected = len(rej_idx[0]) > 0
-        if rejected:
-            for y_r, x_r in zip(rej_idx[0], rej_idx[1]):
-                p_d[y_r, x_r] = ma.masked
-        w = f ** 2 / masked_var
-    p_d.mask = ma.nomask
+        # Fit the profile of all rows at once: the weighted normal equations for
+        # the rows are stacked and solved by a single call into LAPACK.
+        w[p_d_rejected] = 0
+        # Rows with fewer usable pixels than coefficients can't be fitted, e.g. in the
+        # black corners of a rotated image: their profile is left at zero.
+        fit_rows = np.count_nonzero(w, axis=1) >= x_vander.shape[1]
+        lhs = np.einsum('xi,yx,xj->yij', x_vander, w[fit_rows], x_vander)
+        rhs = np.einsum('xi,yx,yx->yi', x_vander, w[fit_rows], p_d[fit_rows])
+        coeffs = np.zeros((net_img.shape[0], x_vander.shape[1]))
+        coeffs[fit_rows] = _solve_stacked(lhs, rhs)
+        np.matmul(coeffs, x_vander.T, out=p_r)
+        np.maximum(p_r, 0, out=p_r)
+        p_sum = np.sum(p_r, axis=0)
+        np.divide(p_r, p_sum, out=p_r, where=p_sum > 0)
+        f = _optimal_flux(p_r, net_img, var_img, tmp)
+        np.multiply(f, p_r, out=f_by_p)
+        _update_variance(f_by_p, sky[rows, cols], config, var_img)
+        _update_residual(net_img, f_by_p, var_img, residual)
+        new_rejects = (residual > 16) & ~p_d_rejected
+        n_rejected = np.count_nonzero(new_rejects)
+        wx.LogMessage(f'stage 1 len rej_idx = {n_rejected}')
+        rejected = n_rejected > 0
+        p_d_rejected |= new_rejects
+        np.divide(f ** 2, var_img, out=w)
 
     if plot:
         for y in range(0, net_img.shape[0]):
@@ -351,45 +364,85 @@ def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_varian
             ax1.plot(x, net_img[y])
             ax2.plot(x, p_d[y], 'ro')
             ax2.plot(x, p_r[y])
-            ax3.plot(x, (net_img[y] - f_by_p[y]) ** 2 / masked_var[y])
+            ax3.plot(x, residual[y])
             plt.show()
     else:
         wx.LogMessage('Extracted raw spectrum.')
 
-    residual.mask = ma.nomask
-    rej_idx = None
+    # Raise the limit in steps of 10 until no more than rej_cutoff pixels exceed it
     limit = 25
     rej_cutoff = 100
-    while rej_idx is None or len(rej_idx[0] > rej_cutoff):
-        rej_idx = np.nonzero(residual > limit)
-        if len(rej_idx[0] > rej_cutoff):
-            limit += 10
+    if residual.size > rej_cutoff:
+        cutoff_residual = np.partition(residual, -rej_cutoff - 1, axis=None)[-rej_cutoff - 1]
+        if cutoff_residual > limit:
+            limit += 10 * ceil((cutoff_residual - limit) / 10)
     wx.LogMessage(f'For cosmic rays rejecting residuals >= {limit}')
+    # Rejected pixels are zeroed in a copy of the profile, so that they drop out of
+    # the sums for the flux estimate. Don't renormalise the profile.
+    p_masked = p_r.copy()
+    sky_img = sky[rows, cols]
+    # Cosmic rays only ever add counts, so skip pixels below the model.
+    residual[(p_masked == 0) | (net_img <= f_by_p)] = 0
+    rej_cols = np.arange(0, net_img.shape[1])
     while True:
-        rej_idx = np.nonzero(residual > limit)
-        if len(rej_idx[0]) == 0:
+        # Columns are independent of each other, so rejecting the worst pixel of
+        # each column is equivalent to rejecting the worst pixel of the image.
+        # Only the columns changed by the previous pass need to be searched again.
+        worst_rows = np.argmax(residual[:, rej_cols], axis=0)
+        rejects = residual[worst_rows, rej_cols] > limit
+        worst_rows = worst_rows[rejects]
+        rej_cols = rej_cols[rejects]
+        if rej_cols.shape[0] == 0:
             break
-        wx.LogMessage(f'len rej_idx = {len(rej_idx[0])}')
-        max_res = 0
-        for y_r, x_r in zip(rej_idx[0], rej_idx[1]):
-            if residual[y_r, x_r] > max_res:
-                max_res = residual[y_r, x_r]
-                y_max = y_r
-                x_max = x_r
-        p_r[y_max, x_max] = ma.masked
-        p_r = p_r / ma.sum(p_r, axis=0)
-        f = ma.sum(p_r * net_img / masked_var, axis=0) / ma.sum(p_r ** 2 / masked_var, axis=0)
-        f_by_p = f * p_r
-        masked_var = (ma.abs(f_by_p + masked_sky) + config.ron ** 2 / config.gain) / config.gain
-        residual = (net_img - f_by_p) ** 2 / masked_var
-        residual.mask = p_r.mask
+        wx.LogMessage(f'len rej_idx = {rej_cols.shape[0]}')
+        p_masked[worst_rows, rej_cols] = 0
+        p_cols = p_masked[:, rej_cols]
+        net_cols = net_img[:, rej_cols]
+        var_cols = var_img[:, rej_cols]
+        f[rej_cols] = _optimal_flux(p_cols, net_cols, var_cols, tmp[:, :rej_cols.shape[0]])
+        f_by_p_cols = f[rej_cols] * p_r[:, rej_cols]
+        _update_variance(f_by_p_cols, sky_img[:, rej_cols], config, var_cols)
+        res_cols = np.empty(net_cols.shape, dtype=np.float32)
+        _update_residual(net_cols, f_by_p_cols, var_cols, res_cols)
+        res_cols[(p_cols == 0) | (net_cols <= f_by_p_cols)] = 0
+        f_by_p[:, rej_cols] = f_by_p_cols
+        var_img[:, rej_cols] = var_cols
+        residual[:, rej_cols] = res_cols
 
     if plot:
         plt.plot(x, f)
-        plt.plot(x, ma.sum(net_img, axis=0) - 20000, 'r-')
+        plt.plot(x, np.sum(net_img, axis=0) - 20000, 'r-')
         plt.show()
 
-    return f
+    spectrum = np.zeros(data.shape[1])
+    spectrum[cols] = f
+    return spectrum
+
+
+def _optimal_flux(profile: npt.NDArray[Any], net_img: npt.NDArray[Any], variance: npt.NDArray[Any],
+                  buf: npt.NDArray[Any]) -> npt.NDArray[Any]:
+    np.multiply(profile, net_img, out=buf)
+    buf /= variance
+    numerator = np.sum(buf, axis=0)
+    np.square(profile, out=buf)
+    buf /= variance
+    denominator = np.sum(buf, axis=0)
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+
+def _update_variance(f_by_p: npt.NDArray[Any], sky: npt.NDArray[Any], config: CameraConfig,
+                     out: npt.NDArray[Any]):
+    np.add(f_by_p, sky, out=out)
+    np.abs(out, out=out)
+    out *= 1.0 / config.gain
+    out += (config.ron / config.gain) ** 2
+
+
+def _update_residual(net_img: npt.NDArray[Any], f_by_p: npt.NDArray[Any], variance: npt.NDArray[Any],
+                     out: npt.NDArray[Any]):
+    np.subtract(net_img, f_by_p, out=out)
+    np.square(out, out=out)
+    out /= variance
 
 
 if __name__ == '__main__':
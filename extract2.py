@@ -27,17 +27,17 @@ class ImageBounds:
     sky_high: int
 
 
-def optimal(image: Path, config: CameraConfig) -> Union[None, Tuple[int]]:
+def optimal(image: Path, config: CameraConfig, plot: bool = False) -> Union[None, Tuple[int]]:
     hdu = fits.open(image)
     data = hdu[0].data
-    image_bounds = _find_image_bounds(data)
+    image_bounds = _find_image_bounds(data, plot)
     variance = (np.abs(data) + config.ron**2 / config.gain) / config.gain
-    sky = _create_sky_image(data, variance, image_bounds)
-    _extract_spectrum(data, sky, variance, image_bounds, config)
+    sky = _create_sky_image(data, variance, image_bounds, plot)
+    _extract_spectrum(data, sky, variance, image_bounds, config, plot)
     return None
 
 
-def _find_image_bounds(data: npt.NDArray[Any]) -> Union[None, ImageBounds]:
+def _find_image_bounds(data: npt.NDArray[Any], plot: bool = False) -> Union[None, ImageBounds]:
     x_avg = np.average(data, axis=1)
     #plt.plot(np.arange(0, x_avg.shape[0]), x_avg)
     #plt.show()
@@ -81,16 +81,17 @@ def _find_image_bounds(data: npt.NDArray[Any]) -> Union[None, ImageBounds]:
     sky_low = int(popt[2] - 8 * popt[3])
     sky_high = int(popt[2] + 8 * popt[3])
 
-    plt.plot([peak], [x_avg[peak]], 'ro')
-    plt.plot(y_vals, model(y_vals, *popt), 'g:')
-    plt.plot([data_low, data_high], [x_avg[data_low], x_avg[data_high]], 'rv')
-    plt.plot([sky_low, sky_high], [x_avg[sky_low], x_avg[sky_high]], 'r*')
-    plt.show()
+    if plot:
+        plt.plot([peak], [x_avg[peak]], 'ro')
+        plt.plot(y_vals, model(y_vals, *popt), 'g:')
+        plt.plot([data_low, data_high], [x_avg[data_low], x_avg[data_high]], 'rv')
+        plt.plot([sky_low, sky_high], [x_avg[sky_low], x_avg[sky_high]], 'r*')
+        plt.show()
     return ImageBounds(data_low, data_high, sky_low, sky_high)
 
 
 def _create_sky_image(data: npt.NDArray[Any], variance: npt.NDArray[Any],
-                      bounds: Union[None, ImageBounds]) -> Union[None, npt.NDArray[Any]]:
+                      bounds: Union[None, ImageBounds], plot: bool = False) -> Union[None, npt.NDArray[Any]]:
     if bounds is None:
         return None
     masked_data = data.view(ma.MaskedArray)
@@ -118,8 +119,11 @@ def _create_sky_image(data: npt.NDArray[Any], variance: npt.NDArray[Any],
 
         rejected = True
         while rejected:
-            poly = npp.Polynomial.fit(x_data, y_data, deg=2, w=y_weights)
-            residual = (y_data - poly(x_data))**2 * y_weights
+            # polyfit doesn't know about masks, so hand it the valid points only
+            valid = ~ma.getmaskarray(x_data)
+            coeffs = npp.polynomial.polyfit(x_data.data[valid], y_data.data[valid], 2,
+                                            w=y_weights.data[valid])
+            residual = (y_data - npp.polynomial.polyval(x_data, coeffs))**2 * y_weights
             rej_idx = ma.nonzero(residual > 16)
             rejected = False
             if len(rej_idx[0]):
@@ -130,49 +134,50 @@ def _create_sky_image(data: npt.NDArray[Any], variance: npt.NDArray[Any],
                 y_weights.mask = y_data.mask
 
         x_data.mask = ma.nomask
-        result[:, x] = poly(x_data)
+        result[:, x] = npp.polynomial.polyval(x_data.data, coeffs)
 
-    #p_img = data - result
-    p_img = result
-    norm = apn.ImageNormalize(p_img, interval=apn.PercentileInterval(95.0), stretch=apn.AsinhStretch())
-    plt.imshow(p_img, origin='lower', norm=norm)
-    plt.show()
+    if plot:
+        #p_img = data - result
+        p_img = result
+        norm = apn.ImageNormalize(p_img, interval=apn.PercentileInterval(95.0), stretch=apn.AsinhStretch())
+        plt.imshow(p_img, origin='lower', norm=norm)
+        plt.show()
 
     return result
 
 
+def _find_nonzero_columns(row: npt.NDArray[Any]) -> Tuple[int, int]:
+    nonzero = np.asarray(row) != 0
+    return int(np.argmax(nonzero)), nonzero.shape[0] - int(np.argmax(nonzero[::-1]))
+
+
 def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_variance: npt.NDArray[Any],
-                      bounds: ImageBounds, config: CameraConfig) -> npt.NDArray[Any]:
+                      bounds: ImageBounds, config: CameraConfig, plot: bool = False) -> npt.NDArray[Any]:
     masked_data = ma.asarray(data[bounds.data_low:bounds.data_high, :])
-    for xd in range(0, masked_data.shape[1]):
-        if masked_data[0, xd] != 0:
-            break
-        masked_data[:, xd] = ma.masked
-    for xd in range(-1, -masked_data.shape[1], -1):
-        if masked_data[0, xd] != 0:
-            break
-        masked_data[:, xd] = ma.masked
+    x_first, x_last = _find_nonzero_columns(masked_data[0])
+    masked_data[:, :x_first] = ma.masked
+    masked_data[:, x_last:] = ma.masked
     masked_sky = ma.asarray(sky[bounds.data_low:bounds.data_high, :])
     masked_var = ma.asarray(init_variance[bounds.data_low:bounds.data_high, :])
     net_img = masked_data - masked_sky
     f_raw = ma.sum(net_img, axis=0)
-    p_d = net_img / f_raw
     w = f_raw**2 / masked_var
+    # smooth continuum by median filtering
     p_d = scn.median_filter(net_img / f_raw, size=(1, 8))
     p_d = ma.asarray(p_d)
-    for y in range(0, p_d.shape[0]):
-        for xd in range(0, p_d.shape[1]):
-            if p_d[0, xd] != 0:
-                break
-            p_d[:, xd] = ma.masked
-        for xd in range(-1, -masked_data.shape[1], -1):
-            if p_d[0, xd] != 0:
-                break
-            p_d[:, xd] = ma.masked
+    x_first, x_last = _find_nonzero_columns(p_d[0])
+    p_d[:, :x_first] = ma.masked
+    p_d[:, x_last:] = ma.masked
 
     p_r = ma.empty(p_d.shape)
     x = ma.arange(0, masked_data.shape[1])
     y_plt = int(p_d.shape[0] / 2)
+    # The fits are done on x scaled to [-1, 1], where a power series of degree 15 is
+    # still reasonably conditioned. All rows are evaluated by a single matrix product
+    # with the Vandermonde matrix of the scaled x values.
+    x_scaled = 2.0 * np.arange(0, masked_data.shape[1]) / (masked_data.shape[1] - 1) - 1.0
+    x_vander = npp.polynomial.polyvander(x_scaled, 15)
+    coeffs = np.empty((masked_data.shape[0], x_vander.shape[1]))
 
     rejected = True
     while rejected:
@@ -181,13 +186,15 @@ def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_varian
             #p_r[y, :] = interpolate.splev(x, tck, der=0)
             #poly = npp.Chebyshev.fit(x, p_d[y, :], deg=5, w=w[y, :])
             #p_r[y, :] = poly(x)
-            poly = npp.Polynomial.fit(x, p_d[y, :], deg=15, w=w[y, :])
-            p_r[y, :] = poly(x)
+            valid = ~(ma.getmaskarray(p_d[y, :]) | ma.getmaskarray(w[y, :]))
+            coeffs[y, :] = npp.polynomial.polyfit(x_scaled[valid], p_d[y, :].data[valid], 15,
+                                                  w=w[y, :].data[valid])
+        p_r[:, :] = coeffs @ x_vander.T
         p_r[p_r < 0] = 0
         p_r = p_r / ma.sum(p_r, axis=0)
         f = ma.sum(p_r * net_img / masked_var, axis=0) / ma.sum(p_r**2 / masked_var, axis=0)
         f_by_p = f * p_r
-        masked_var = (ma.abs(f_by_p + masked_sky) + config.ron**2 / config.gain) / config.gain
+        masked_var = _update_variance(f_by_p, masked_sky, config)
         residual = (net_img - f_by_p)**2 / masked_var
         residual.mask = p_d.mask
         rej_idx = np.nonzero(residual > 16)
@@ -198,13 +205,14 @@ def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_varian
                 p_d[y_r, x_r] = ma.masked
         w = f**2 / masked_var
     p_d.mask = ma.nomask
-    for y in range(0, net_img.shape[0]):
-        fig, (ax1, ax2, ax3) = plt.subplots(3, 1)
-        ax1.plot(x, net_img[y])
-        ax2.plot(x, p_d[y], 'ro')
-        ax2.plot(x, p_r[y])
-        ax3.plot(x, (net_img[y] - f_by_p[y])**2 / masked_var[y])
-        plt.show()
+    if plot:
+        for y in range(0, net_img.shape[0]):
+            fig, (ax1, ax2, ax3) = plt.subplots(3, 1)
+            ax1.plot(x, net_img[y])
+            ax2.plot(x, p_d[y], 'ro')
+            ax2.plot(x, p_r[y])
+            ax3.plot(x, (net_img[y] - f_by_p[y])**2 / masked_var[y])
+            plt.show()
 
     residual.mask = ma.nomask
     rej_idx = None
@@ -231,17 +239,26 @@ def _extract_spectrum(data: npt.NDArray[Any], sky: npt.NDArray[Any], init_varian
         f = ma.sum(p_r * net_img / masked_var, axis=0) / ma.sum(p_r**2 / masked_var, axis=0)
         f_by_p = f * p_r
         mask = f_by_p.mask[y_max, x_max]
-        masked_var = (ma.abs(f_by_p + masked_sky) + config.ron**2 / config.gain) / config.gain
+        masked_var = _update_variance(f_by_p, masked_sky, config)
         residual = (net_img - f_by_p)**2 / masked_var
         residual.mask = p_r.mask
 
-    plt.plot(x, f)
-    plt.plot(x, ma.sum(net_img, axis=0) - 20000, 'r-')
-    plt.show()
+    if plot:
+        plt.plot(x, f)
+        plt.plot(x, ma.sum(net_img, axis=0) - 20000, 'r-')
+        plt.show()
 
     return f
 
 
+def _update_variance(f_by_p: npt.NDArray[Any], sky: npt.NDArray[Any], config: CameraConfig) -> npt.NDArray[Any]:
+    variance = f_by_p + sky
+    np.abs(variance, out=variance)
+    variance *= 1.0 / config.gain
+    variance += (config.ron / config.gain)**2
+    return variance
+
+
 if __name__ == '__main__':
     #input_file = Path.home() / 'astrowrk/spectra/uvex4/20230610/slant-corr/Castor_Light_001.fits'
     input_file = Path.home() / 'astrowrk/spectra/uvex4/20230610/slant-corr/Sheliak_Light_60_secs_001.fits'
@@ -250,4 +267,4 @@ if __name__ == '__main__':
     cam_cfg = CameraConfig(1.89, 0.0864)
     # ST10 XME
     #cam_cfg = CameraConfig(13, 1.3)
-    optimal(input_file, cam_cfg)
\ No newline at end of file
+    optimal(input_file, cam_cfg, plot=True)
\ No newline at end of file
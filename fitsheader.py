@@ -19,18 +19,26 @@ class FitsHeaderDialog(wx.Dialog):
         value_width = list_ctrl.GetFullTextExtent('M' * 80)[0]
         list_ctrl.InsertColumn(1, 'Attribute Value', width=value_width)
 
-        with fits.open(file) as hdu_l:
-            header = hdu_l[0].header
-        row_idx = 0
-        for item_key in header.keys():
-            if item_key not in ('HISTORY', 'COMMENT'):
-                FitsHeaderDialog._insert_label_and_text(list_ctrl, row_idx, item_key, header[item_key])
-                row_idx += 1
-        for item_key in ('HISTORY', 'COMMENT'):
-            if item_key in header:
-                for line in header[item_key]:
-                    FitsHeaderDialog._insert_label_and_text(list_ctrl, row_idx, item_key, line)
-                    row_idx += 1
+        header = fits.getheader(file, ext=0)
+        rows = []
+        history = []
+        comments = []
+        for card in header.cards:
+            if card.keyword == 'HISTORY':
+                history.append((card.keyword, card.value))
+            elif card.keyword == 'COMMENT':
+                comments.append((card.keyword, card.value))
+            else:
+                rows.append((card.keyword, card.value))
+        rows.extend(history)
+        rows.extend(comments)
+        # Don't redraw the list for every single row
+        list_ctrl.Freeze()
+        try:
+            for row_idx in range(len(rows)):
+                FitsHeaderDialog._insert_label_and_text(list_ctrl, row_idx, *rows[row_idx])
+        finally:
+            list_ctrl.Thaw()
 
         vbox = wx.BoxSizer(wx.VERTICAL)
         vbox.Add(list_ctrl, 1, wx.EXPAND, 0)
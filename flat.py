@@ -1,15 +1,16 @@
 import numpy as np
+import numpy.polynomial as npp
 import numpy.typing as npt
+import os
+import queue
 import wx
 
 from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from numpy.polynomial import Polynomial
 from pathlib import Path
 from typing import Union, Any, Tuple, Sequence
 
-import matplotlib.pyplot as plt
-
 
 @dataclass(frozen=True)
 class FlatParam:
@@ -28,34 +29,52 @@ def auto_flat(flat_path: Path, input_files: Union[Path, Sequence[Path]], output_
 def apply(param: FlatParam, input_files: Union[Path, Sequence[Path]], output_path: Path):
     if isinstance(input_files, Path):
         input_files = (input_files, )
-
-    for input_file in input_files:
-        in_hdu_l = fits.open(input_file)
-        header = in_hdu_l[0].header
-        data = in_hdu_l[0].data
-        if param.x_lo == 0 and param.x_hi == 0 and param.y_lo == param.y_hi:
-            out_data = data
-        else:
-            out_data = data[param.y_lo:param.y_hi, param.x_lo:param.x_hi]
-        out_data = out_data / param.flat
-        in_hdu_l.close()
+    if not input_files:
+        return
+
+    # Multiplying is a lot cheaper than dividing, and the flat is the same for all files
+    inv_flat = np.reciprocal(param.flat, dtype=np.float32)
+    # The files are independent of each other and numpy as well as the file I/O
+    # release the GIL most of the time, so process them in parallel.
+    max_workers = min(len(input_files), os.cpu_count() or 1)
+    # One output buffer per worker, handed back once the result has been written
+    buffers = queue.SimpleQueue()
+    for _ in range(max_workers):
+        buffers.put(np.empty(inv_flat.shape, dtype=np.float32))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_apply_single, param, inv_flat, buffers, input_file, output_path)
+                   for input_file in input_files]
+        for future in futures:
+            future.result()
+
+
+def _apply_single(param: FlatParam, inv_flat: npt.NDArray[Any], buffers: queue.SimpleQueue,
+                  input_file: Path, output_path: Path):
+    out_data = buffers.get()
+    try:
+        with fits.open(input_file) as in_hdu_l:
+            header = in_hdu_l[0].header
+            data = in_hdu_l[0].data
+            if not (param.x_lo == 0 and param.x_hi == 0 and param.y_lo == param.y_hi):
+                data = data[param.y_lo:param.y_hi, param.x_lo:param.x_hi]
+            # Single precision is plenty for flat fielded 16 bit data
+            np.multiply(data, inv_flat, out=out_data)
         out_hdu = fits.PrimaryHDU(out_data, header)
-        out_hdu.writeto(output_path / input_file.name, overwrite=True)
+        out_hdu.writeto(output_path / input_file.name, overwrite=True, output_verify='ignore')
+    finally:
+        buffers.put(out_data)
 
 
 def _find_shortest_black(row_or_col: npt.NDArray[Any]) -> Tuple[int, int]:
     if row_or_col[0] != 0:
         return 0, 0
-    i_low = 0
-    for i in range(0, row_or_col.shape[0]):
-        if row_or_col[i] != 0:
-            i_low = i
-            break
-    i_hi = row_or_col.shape[0]
-    for i in range(row_or_col.shape[0] - 1, 0, -1):
-        if row_or_col[i] != 0:
-            i_hi = i
-            break
+    nonzero = np.flatnonzero(row_or_col)
+    if nonzero.shape[0] == 0:
+        i_low = 0
+        i_hi = row_or_col.shape[0]
+    else:
+        i_low = int(nonzero[0])
+        i_hi = int(nonzero[-1])
 
     if row_or_col.shape[0] - i_hi < i_low:
         return row_or_col.shape[0] - i_hi, i_hi
@@ -76,25 +95,19 @@ def _compute_flat(flat_path: Path) -> FlatParam:
         cropped_data = data[y_lo:y_hi, x_lo:x_hi]
     flat_hdu_l.close()
 
-    fitted = np.empty(cropped_data.shape, dtype=np.float64)
-    xdata = np.arange(0, cropped_data.shape[1])
-    for i in range(0, cropped_data.shape[0]):
-        poly = Polynomial.fit(xdata, cropped_data[i, :], deg=5)
-        # noinspection PyCallingNonCallable
-        fitted[i, :] = poly(xdata)
-        # plt.plot(xdata, cropped_data[i, :], 'b-')
-        # plt.plot(xdata, fitted[i, :], 'r-')
-        # plt.show()
+    # All rows share the same abscissa, so the least squares projection onto a
+    # Chebyshev series on [-1, 1] is the same for all of them: compute it once and
+    # fit and evaluate all rows with two matrix products.
+    xdata = np.linspace(-1.0, 1.0, cropped_data.shape[1])
+    vander = npp.chebyshev.chebvander(xdata, 5)
+    coeffs = cropped_data @ np.linalg.pinv(vander).T
+    fitted = coeffs @ vander.T
     mean_signal = np.mean(cropped_data, axis=0)
-    cropped_data = cropped_data / fitted
-    x_min = 0
-    for x in range(0, mean_signal.shape[0]):
-        if mean_signal[x] > 10000:
-            x_min = x
-            break
+    # The model isn't needed any more, so normalise into its buffer
+    flat = np.divide(cropped_data, fitted, out=fitted)
+    x_min = int(np.argmax(mean_signal > 10000))
     if x_min != 0:
-        for y in range(0, cropped_data.shape[0]):
-            cropped_data[y, :] = cropped_data[y, :] / cropped_data[y, x_min]
-            cropped_data[y, 0:x_min] = 1.0
+        flat /= flat[:, x_min:x_min + 1].copy()
+        flat[:, 0:x_min] = 1.0
 
-    return FlatParam(cropped_data, x_lo, y_lo, x_hi, y_hi)
+    return FlatParam(flat, x_lo, y_lo, x_hi, y_hi)
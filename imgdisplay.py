@@ -1,5 +1,6 @@
 from astropy.io import fits
 from astropy.visualization import ImageNormalize, MinMaxInterval, PercentileInterval, AsinhStretch
+from collections import OrderedDict
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from matplotlib.backends.backend_wxagg import NavigationToolbar2WxAgg as NavigationToolbar
 from matplotlib.figure import Figure
@@ -10,6 +11,8 @@ import wx
 
 
 class ImageDisplay(wx.Panel):
+    _NORM_CACHE_SIZE = 16
+
     def __init__(self, parent: wx.Window, **kwargs):
         super().__init__(parent, **kwargs)
 
@@ -25,6 +28,7 @@ class ImageDisplay(wx.Panel):
         self.Fit()
 
         self._image = None
+        self._limits = OrderedDict()
 
     def display(self, file: Union[str, bytes, PathLike]):
         file_path = Path(file)
@@ -33,10 +37,25 @@ class ImageDisplay(wx.Panel):
         with fits.open(file_path) as in_hdu_l:
             self._axes.cla()
             self._image = in_hdu_l[0].data
-            norm = ImageNormalize(self._image, interval=PercentileInterval(90.0), stretch=AsinhStretch())
+            vmin, vmax = self._get_limits(file_path)
+            norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=AsinhStretch())
             self._axes.imshow(self._image, origin='lower', norm=norm)
             self._canvas.draw()
 
+    def _get_limits(self, file_path: Path):
+        # The percentile interval sorts the whole image, so remember the limits
+        # until the file changes on disk.
+        key = (file_path.resolve(), file_path.stat().st_mtime_ns)
+        limits = self._limits.get(key)
+        if limits is not None:
+            self._limits.move_to_end(key)
+            return limits
+        limits = PercentileInterval(90.0).get_limits(self._image)
+        self._limits[key] = limits
+        if len(self._limits) > ImageDisplay._NORM_CACHE_SIZE:
+            self._limits.popitem(last=False)
+        return limits
+
 
 if __name__ == '__main__':
     app = wx.App()
@@ -1,18 +1,15 @@
 import astropy.units as u
+import bisect
 import config
-import matplotlib as plot
 import numpy as np
-import numpy.ma as ma
 import numpy.typing as npt
-import re
 import specview
-import threading
 import typing as ty
 import wx
 import wxutil
 import wx.lib.newevent as ne
 
-from astropy.table import table
+from concurrent.futures import ThreadPoolExecutor
 from astroquery.nist import Nist
 
 
@@ -22,6 +19,7 @@ _colours = ['xkcd:lime green', 'xkcd:light magenta', 'xkcd:teal', 'xkcd:light pu
             'xkcd:light red', 'xkcd:cerulean', 'xkcd:dark cyan', 'xkcd:tangerine', 'xkcd:maize']
 _rgb_colours = [wx.Colour(0x89fe05), wx.Colour(0xfa5ff7), wx.Colour(0x029386), wx.Colour(0xbf77f6), wx.Colour(0xfac205),
                 wx.Colour(0xff474c), wx.Colour(0x0485d1), wx.Colour(0x0a888a), wx.Colour(0xff9408), wx.Colour(0xf4d054)]
+_nist_executor = ThreadPoolExecutor(max_workers=2)
 
 
 class LineIDDialog(wx.Dialog):
@@ -55,6 +53,9 @@ class LineIDDialog(wx.Dialog):
         self._species_list.Bind(wx.EVT_LIST_KEY_DOWN, self._on_list_key_down)
 
         self._loaded = dict()
+        self._lines = dict()
+        self._sorted_keys = []
+        self._in_flight = set()
         self._min_wavelen = min_wavelen
         self._max_wavelen = max_wavelen
         self._specview = specview
@@ -65,105 +66,93 @@ class LineIDDialog(wx.Dialog):
         if not species:
             return
         key = species.upper()
-        if key in self._loaded:
+        if key in self._loaded or key in self._in_flight:
             return
-        species_table = config.Config.get().get_calib_table(species)
-        if species_table:
-            self._display_species(species, species_table)
+        lines = config.Config.get().get_calib_lines(species)
+        if lines is not None:
+            self._display_species(species, lines)
         else:
+            self._in_flight.add(key)
             wx.BeginBusyCursor()
-            thread = threading.Thread(target=self._retrieve_species, args=[species])
-            thread.start()
+            _nist_executor.submit(self._retrieve_species, species)
 
     def _retrieve_species(self, species: str):
         try:
             ref_spectrum = Nist.query(config.MIN_WAVELEN * u.AA, config.MAX_WAVELEN * u.AA,
                                       linename=species, wavelength_type='vac+air')
         except Exception as e:
-            self.QueueEvent(NistEvent(msg=e.args[0]))
+            self.QueueEvent(NistEvent(msg=e.args[0], species=species))
         else:
             config.Config.get().save_calib_table(species, ref_spectrum)
             self.QueueEvent(NistEvent(msg=None, species=species))
 
-    def _display_species(self, species: str, spec_table: table.Table):
+    def _display_species(self, species: str, lines: ty.Tuple[npt.NDArray[ty.Any], npt.NDArray[ty.Any]]):
         global _colours
         global _rgb_colours
-        wavelengths = []
-        intensities = []
-        for wavelength, rel_int in spec_table.iterrows('Observed', 'Rel.'):
-            if wavelength is ma.masked or wavelength < self._min_wavelen:
-                continue
-            if wavelength > self._max_wavelen:
-                break
-            try:
-                rel_i_m = re.match(r'\d+', str(rel_int))
-                if not rel_i_m:
-                    continue
-                rel_int = float(rel_i_m.group(0))
-            except ValueError:
-                continue
-            except ma.core.MaskError:
-                continue
-            wavelengths.append(wavelength)
-            intensities.append(rel_int)
+        wavelengths, np_intens = self._select_lines(lines)
         if len(wavelengths) == 0:
             return
-        np_intens = np.array(intensities)
-        np_intens = np_intens / (2 * np.max(np_intens))
         # XKCD colours are at https://xkcd.com/color/rgb/
         line_coll = self._specview.add_vlines(wavelengths, np_intens,
                                               _rgb_colours[self._colour_idx].GetAsString(wx.C2S_HTML_SYNTAX))
         key = species.upper()
-        if not self._loaded:
+        idx = bisect.bisect_left(self._sorted_keys, key)
+        if idx == len(self._sorted_keys):
             self._species_list.Append([species])
-            idx = 0
         else:
-            idx = -1
-            for (i, spec_key) in enumerate(sorted(self._loaded.keys())):
-                if spec_key > key:
-                    idx = i
-                    break
-            if idx == -1:
-                self._species_list.Append([species])
-                idx = len(self._loaded.keys())
-            else:
-                self._species_list.InsertItem(idx, species)
+            self._species_list.InsertItem(idx, species)
+        self._sorted_keys.insert(idx, key)
         self._species_list.SetItemBackgroundColour(idx, _rgb_colours[self._colour_idx])
         self._loaded[key] = line_coll
+        self._lines[key] = lines
         self._colour_idx += 1
         if self._colour_idx == len(_colours):
             self._colour_idx = 0
 
+    def _select_lines(self, lines: ty.Tuple[npt.NDArray[ty.Any], npt.NDArray[ty.Any]]):
+        wavelengths, intensities = lines
+        lower = np.searchsorted(wavelengths, self._min_wavelen, side='left')
+        upper = np.searchsorted(wavelengths, self._max_wavelen, side='right')
+        if lower == upper:
+            return wavelengths[lower:upper], intensities[lower:upper]
+        return wavelengths[lower:upper], intensities[lower:upper] * (0.5 / np.max(intensities[lower:upper]))
+
     def _retrieval_done(self, event: NistEvent):
         wx.EndBusyCursor()
+        self._in_flight.discard(event.species.upper())
         if event.msg is not None:
             with wx.MessageDialog(self, event.msg, style=wx.OK | wx.CENTRE | wx.ICON_ERROR) as dlg:
                 dlg.ShowModal()
         else:
-            species = event.species
-            species_table = config.Config.get().get_calib_table(species)
-            self._display_species(species, species_table)
+            lines = config.Config.get().get_calib_lines(event.species)
+            if lines is not None:
+                self._display_species(event.species, lines)
 
     def _on_list_key_down(self, event: wx.ListEvent):
         # This looks iffy: I'd rather use a portable way to refer to delete and backspace...
         if event.GetKeyCode() in (8, 127):
-            sorted_keys = sorted(self._loaded.keys())
-            deleted_key = sorted_keys[event.GetIndex()]
-            line_coll = self._loaded[deleted_key]
+            deleted_key = self._sorted_keys.pop(event.GetIndex())
+            line_coll = self._loaded.pop(deleted_key)
+            del self._lines[deleted_key]
             self._specview.remove_vlines(line_coll)
-            del self._loaded[deleted_key]
             self._species_list.DeleteItem(event.GetIndex())
 
     def clear_all_lines(self):
-        sorted_keys = sorted(self._loaded.keys())
-        for k in sorted_keys:
-            self._specview.remove_vlines(self._loaded[k])
-            self._species_list.DeleteItem(0)
+        for line_coll in self._loaded.values():
+            self._specview.remove_vlines(line_coll)
+        self._species_list.DeleteAllItems()
         self._loaded.clear()
+        self._lines.clear()
+        self._sorted_keys.clear()
 
     def set_limit(self, min_wavelen, max_wavelen):
+        if min_wavelen == self._min_wavelen and max_wavelen == self._max_wavelen:
+            return
         self._min_wavelen = min_wavelen
         self._max_wavelen = max_wavelen
+        for key, line_coll in self._loaded.items():
+            wavelengths, np_intens = self._select_lines(self._lines[key])
+            self._specview.set_vlines(line_coll, wavelengths, np_intens)
 
 
 _dialog: ty.Union[None, LineIDDialog] = None
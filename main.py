@@ -1,5 +1,6 @@
 import numpy as np
 import sys
+from functools import lru_cache
 from pathlib import Path
 from typing import Tuple, Union
 
@@ -33,6 +34,16 @@ ID_MEASURE = wx.NewIdRef()
 ID_CROP_SPEC = wx.NewIdRef()
 ID_LINEID = wx.NewIdRef()
 
+_spectrum_tools = (ID_ANNOTATE, ID_RECTIFY, ID_MEASURE, ID_CROP_SPEC)
+_resource_dir = Path(__file__).absolute().parent / 'resources'
+
+
+@lru_cache(maxsize=None)
+def _load_bitmap(name: str) -> wx.Bitmap:
+    bitmap = wx.Bitmap()
+    bitmap.LoadFile(str(_resource_dir / name))
+    return bitmap
+
 
 class Main(wx.Frame):
     def __init__(self, parent, **kwargs):
@@ -80,38 +91,29 @@ class Main(wx.Frame):
         self.SetMenuBar(menubar)
 
         self._toolbar = self.CreateToolBar()
-        resource_dir = Path(__file__).absolute().parent / 'resources'
-        annotate_bmp = wx.Bitmap()
-        annotate_bmp.LoadFile(str(resource_dir / 'pencil@1x.png'))
+        annotate_bmp = _load_bitmap('pencil@1x.png')
         self._toolbar.SetToolBitmapSize(wx.Size(24, 24))
         annotate_tool = self._toolbar.AddCheckTool(ID_ANNOTATE.GetId(), 'Annotate', annotate_bmp,
                                                    shortHelp='Add annotation to image')
 
-        rectify_bmp = wx.Bitmap()
-        rectify_bmp.LoadFile(str(resource_dir / 'funnel@1x.png'))
+        rectify_bmp = _load_bitmap('funnel@1x.png')
         rectify_tool = self._toolbar.AddCheckTool(ID_RECTIFY.GetId(), 'Rectify', rectify_bmp,
                                                   shortHelp='Rectify spectrum')
 
-        measure_bmp = wx.Bitmap()
-        measure_bmp.LoadFile(str(resource_dir / 'ruler@1x.png'))
+        measure_bmp = _load_bitmap('ruler@1x.png')
         measure_tool = self._toolbar.AddCheckTool(ID_MEASURE.GetId(), 'Measure', measure_bmp,
                                                   shortHelp='Measure peaks')
 
-        crop_spec_bmp = wx.Bitmap()
-        crop_spec_bmp.LoadFile((str(resource_dir / 'scissors@1x.png')))
+        crop_spec_bmp = _load_bitmap('scissors@1x.png')
         crop_spec_tool = self._toolbar.AddCheckTool(ID_CROP_SPEC.GetId(), 'Crop', crop_spec_bmp,
                                                     shortHelp='Crop spectrum')
 
-        lineid_bmp = wx.Bitmap()
-        lineid_bmp.LoadFile((str(resource_dir / 'magglass@1x.png')))
+        lineid_bmp = _load_bitmap('magglass@1x.png')
         lineid_tool = self._toolbar.AddCheckTool(ID_LINEID.GetId(), 'Line ID', lineid_bmp,
                                                  shortHelp='Identify Spectral Lines')
 
         self._toolbar.Realize()
-        self._toolbar.EnableTool(ID_ANNOTATE.GetId(), False)
-        self._toolbar.EnableTool(ID_RECTIFY.GetId(), False)
-        self._toolbar.EnableTool(ID_MEASURE.GetId(), False)
-        self._toolbar.EnableTool(ID_CROP_SPEC.GetId(), False)
+        self._enable_others(None, False)
         self._toolbar.EnableTool(ID_LINEID.GetId(), False)
 
         self._content_pane = wx.Panel(self)
@@ -136,20 +138,16 @@ class Main(wx.Frame):
         self.Bind(wx.EVT_MENU, self._show_header, header_item)
         self.Bind(wx.EVT_MENU, lambda evt: wxutil.set_object_name(self), objname_item)
         self.Bind(wx.EVT_MENU, lambda evt: sys.exit(0), exit_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, Combine(self)), combine_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, Crop(self)), crop_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, Reduce(self)), reduce_item)
         self.Bind(wx.EVT_MENU, self._show_calib_file_dialog, calib_item)
         self.Bind(wx.EVT_MENU, self._run_calc_response, calc_resp_item)
         self.Bind(wx.EVT_MENU, self._show_flat_response_dlg, resp_flat_item)
         self.Bind(wx.EVT_MENU, self._run_apply_response, apply_resp_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, TelescopeCfgGui(self)), telescope_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, SpectrometerCfgGui(self)), spectro_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, CamCfgGUI(self)), camera_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, AavsoCfgGui(self)), aavso_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, AavsoObscodeCfgGui(self)), obs_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, LocationCfgGui(self)), loc_item)
-        self.Bind(wx.EVT_MENU, lambda evt: Main._show_dialog(evt, calib2.CalibConfigurator(self)), calib_cfg_item)
+        dialogs = ((combine_item, Combine), (crop_item, Crop), (reduce_item, Reduce),
+                   (telescope_item, TelescopeCfgGui), (spectro_item, SpectrometerCfgGui), (camera_item, CamCfgGUI),
+                   (aavso_item, AavsoCfgGui), (obs_item, AavsoObscodeCfgGui), (loc_item, LocationCfgGui),
+                   (calib_cfg_item, calib2.CalibConfigurator))
+        for item, dialog_class in dialogs:
+            self.Bind(wx.EVT_MENU, lambda evt, cls=dialog_class: Main._show_dialog(evt, cls(self)), item)
         self._toolbar.Bind(wx.EVT_MENU, self._toggle_annotate, annotate_tool)
         self._toolbar.Bind(wx.EVT_MENU, self._toggle_rectify, rectify_tool)
         self._toolbar.Bind(wx.EVT_MENU, self._toggle_measure, measure_tool)
@@ -192,9 +190,14 @@ class Main(wx.Frame):
         if visible == self._specview_visible:
             return
         sizer = self._content_pane.GetSizer()
-        sizer.Show(self._image_display, not visible)
-        sizer.Show(self._specview, visible)
-        sizer.Layout()
+        # Swap the panels without painting the intermediate layout
+        self._content_pane.Freeze()
+        try:
+            sizer.Show(self._image_display, not visible)
+            sizer.Show(self._specview, visible)
+            sizer.Layout()
+        finally:
+            self._content_pane.Thaw()
         self._specview_visible = visible
         self.Layout()
 
@@ -205,10 +208,11 @@ class Main(wx.Frame):
             return
         file_path = Path(file_name)
         self.SetTitle(f'Spectra - {file_path.name}')
-        hdu_l = fits.open(file_name)
-        header = hdu_l[0].header
-        data = hdu_l[0].data
-        hdu_l.close()
+        with fits.open(file_name) as hdu_l:
+            header = hdu_l[0].header
+            # Images are displayed from the file by ImageDisplay, so only read the data for spectra.
+            is_spectrum = header['NAXIS'] == 1 or header[f'NAXIS{header["NAXIS"]}'] == 1
+            data = hdu_l[0].data if is_spectrum else None
         self._file_menu.Enable(ID_SAVE, False)
         if self._specview_visible:
             self._toolbar.ToggleTool(ID_ANNOTATE, False)
@@ -217,7 +221,7 @@ class Main(wx.Frame):
             self._specview.toggle_event_handler(None)
             self._file_menu.Enable(ID_SAVE.GetId(), False)
 
-        if header['NAXIS'] == 1 or data.shape[0] == 1:
+        if is_spectrum:
             if data.shape[0] == 1:
                 disp_data = data[0]
             else:
@@ -226,19 +230,12 @@ class Main(wx.Frame):
             self._specview.clear()
             self._specview.add_spectrum(disp_data, header)
             menu.Enable(ID_ADD_SP.GetId(), True)
-            self._toolbar.EnableTool(ID_ANNOTATE.GetId(), True)
-            self._toolbar.EnableTool(ID_RECTIFY.GetId(), True)
-            self._toolbar.EnableTool(ID_MEASURE.GetId(), True)
-            self._toolbar.EnableTool(ID_CROP_SPEC.GetId(), True)
+            self._enable_others(None, True)
         elif header['NAXIS'] == 2:
-            data = None
             self.make_specview_visible(False)
             self._image_display.display(file_name)
             menu.Enable(ID_ADD_SP.GetId(), False)
-            self._toolbar.EnableTool(ID_ANNOTATE.GetId(), False)
-            self._toolbar.EnableTool(ID_RECTIFY.GetId(), False)
-            self._toolbar.EnableTool(ID_MEASURE.GetId(), False)
-            self._toolbar.EnableTool(ID_CROP_SPEC.GetId(), False)
+            self._enable_others(None, False)
 
         self._toolbar.EnableTool(ID_LINEID.GetId(), self._specview_visible and self._specview.min_wavelen is not None)
         lineid.clear_lines()
@@ -255,21 +252,19 @@ class Main(wx.Frame):
         file_name = wxutil.select_file(self)
         if not file_name:
             return
-        file_path = Path(file_name)
-        with fits.open(file_path) as hdu_l:
-            data = hdu_l[0].data
-            header = hdu_l[0].header
-        if header['NAXIS'] != 1 and data.shape[0] != 1:
+        header = fits.getheader(file_name, ext=0)
+        if header['NAXIS'] != 1 and header[f'NAXIS{header["NAXIS"]}'] != 1:
             return
         if 'CRVAL1' not in header:
             return
+        data = fits.getdata(file_name, ext=0)
         self._file_menu.Enable(ID_SAVE, False)
         if data.shape[0] == 1:
             data = data[0, :]
-        data_max = np.max(data)
-        if data_max != 1.0:
-            data = data / data_max
-        data = data + 0.1 * self._specview.current_max
+        data_max = float(np.nanmax(data))
+        scale = 1.0 / data_max if data_max != 0.0 else 1.0
+        data = np.multiply(data, scale, dtype=np.float64)
+        data += 0.1 * self._specview.current_max
         self._specview.add_spectrum(data, header)
 
     def _show_header(self, event: wx.CommandEvent):
@@ -284,15 +279,10 @@ class Main(wx.Frame):
         dlg.Bind(wx.EVT_SHOW, lambda evt: Main._enable_after_close(evt, menu, item))
         dlg.Show()
 
-    def _enable_others(self, selected_id: int, enable: bool):
-        if ID_ANNOTATE.GetId() != selected_id:
-            self._toolbar.EnableTool(ID_ANNOTATE.GetId(), enable)
-        if ID_MEASURE.GetId() != selected_id:
-            self._toolbar.EnableTool(ID_MEASURE.GetId(), enable)
-        if ID_RECTIFY.GetId() != selected_id:
-            self._toolbar.EnableTool(ID_RECTIFY.GetId(), enable)
-        if ID_CROP_SPEC.GetId() != selected_id:
-            self._toolbar.EnableTool(ID_CROP_SPEC.GetId(), enable)
+    def _enable_others(self, selected_id: Union[int, None], enable: bool):
+        for tool in _spectrum_tools:
+            if tool.GetId() != selected_id:
+                self._toolbar.EnableTool(tool.GetId(), enable)
 
     def _toggle_annotate(self, event: wx.CommandEvent):
         if event.GetSelection():
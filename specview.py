@@ -196,13 +196,12 @@ class ContinuumFit(SpecEvtHandler, SaveHandler):
                 ydata[idx] = ma.masked
         # Now create a spline from the polynom in order to allow the user to add/remove points
         interval = int((data.size - 1)/ 20)
-        self._x_pick = []
-        self._y_pick = []
-        for idx in range(0, data.size, interval):
-            self._x_pick.append(self._xdata[idx])
+        pick_idx = np.arange(0, data.size, interval)
         if 20 * interval != data.size - 1:
-            self._x_pick.append(self._xdata[-1])
-        self._y_pick = list(poly(np.asarray(self._x_pick)))
+            pick_idx = np.append(pick_idx, data.size - 1)
+        x_pick = self._xdata[pick_idx]
+        self._x_pick = list(x_pick)
+        self._y_pick = list(poly(x_pick))
 
         tck = interpolate.splrep(self._x_pick, self._y_pick, s=0, k=3)
         self._continuum = interpolate.splev(self._xdata, tck, der=0)
@@ -236,15 +235,7 @@ class ContinuumFit(SpecEvtHandler, SaveHandler):
         x_idx = int((event.xdata - self._xdata[0]) / (self._xdata[1] - self._xdata[0]))
         x = self._xdata[x_idx]
         y = event.ydata
-        min_idx = 0
-        min_delta = None
-        for i in range(0, len(self._x_pick)):
-            delta = abs(self._x_pick[i] - x)
-            if min_delta is None or delta < min_delta:
-                min_delta = delta
-                min_idx = i
-            elif delta > min_delta:
-                break
+        min_idx = int(np.argmin(np.abs(np.asarray(self._x_pick) - x)))
         closest_marker_data = (self._x_pick[min_idx], self._y_pick[min_idx])
         closest_marker_screen = self._axes.transData.transform(closest_marker_data)
         event_screen = self._axes.transData.transform((x, y))
@@ -255,15 +246,14 @@ class ContinuumFit(SpecEvtHandler, SaveHandler):
                 return
             self._pick_sel_idx = min_idx
             line_modified = False
-        elif x < self._x_pick[min_idx]:
-            self._x_pick = self._x_pick[0:min_idx] + [x] + self._x_pick[min_idx:]
-            self._y_pick = self._y_pick[0:min_idx] + [y] + self._y_pick[min_idx:]
-            self._pick_sel_idx = min_idx
-            line_modified = True
         else:
-            self._x_pick = self._x_pick[0:min_idx + 1] + [x] + self._x_pick[min_idx + 1:]
-            self._y_pick = self._y_pick[0:min_idx + 1] + [y] + self._y_pick[min_idx + 1:]
-            self._pick_sel_idx = min_idx + 1
+            # Insert in place, keeping the pick points sorted by x
+            if x < self._x_pick[min_idx]:
+                self._pick_sel_idx = min_idx
+            else:
+                self._pick_sel_idx = min_idx + 1
+            self._x_pick.insert(self._pick_sel_idx, x)
+            self._y_pick.insert(self._pick_sel_idx, y)
             line_modified = True
 
         if self._pick_sel_line is not None:
@@ -289,8 +279,8 @@ class ContinuumFit(SpecEvtHandler, SaveHandler):
         if self._continuum_line is None:
             return
         if self._pick_sel_idx is not None and event.key == 'delete':
-            self._x_pick = self._x_pick[0:self._pick_sel_idx] + self._x_pick[self._pick_sel_idx + 1:]
-            self._y_pick = self._y_pick[0:self._pick_sel_idx] + self._y_pick[self._pick_sel_idx + 1:]
+            del self._x_pick[self._pick_sel_idx]
+            del self._y_pick[self._pick_sel_idx]
             self._pick_sel_idx = None
             self._pick_sel_line.remove()
             self._pick_sel_line = None
@@ -672,6 +662,13 @@ class Specview(wx.Panel):
         self._canvas.draw_idle()
         return result
 
+    def set_vlines(self, line_coll, xdata, ymax):
+        segments = np.zeros((len(xdata), 2, 2))
+        segments[:, :, 0] = np.asarray(xdata)[:, np.newaxis]
+        segments[:, 1, 1] = ymax
+        line_coll.set_segments(segments)
+        self._canvas.draw_idle()
+
     def remove_vlines(self, line_coll):
         line_coll.remove()
         self._canvas.draw_idle()